@@ -1,9 +1,12 @@
 from typing import Dict, Iterable, Union, Optional
-import subprocess
+from collections import defaultdict
+from operator import attrgetter
+import heapq
+import importlib
+import struct
 import pathlib
 
 import numpy as np
-import yaml
 from pyrosenv import rosbag, rospy
 from pyrosenv import genpy
 
@@ -29,20 +32,143 @@ class BagManagerException(Exception):
     pass
 
 
+def _float_to_ns(time: float) -> int:
+    """ Return the given time in seconds in nanoseconds, converted the same way rospy.Time(float) does it """
+    secs = int(time)
+    return secs * 1000000000 + int((time - secs) * 1000000000)
+
+
+_TO_NS_BY_TYPE = {float: _float_to_ns, np.float64: _float_to_ns, int: lambda time: time * 1000000000,
+                  rospy.Time: rospy.Time.to_nsec, genpy.Time: genpy.Time.to_nsec}
+
+
+def _to_ns(time: TimeLike) -> int:
+    """ Return the given time in nanoseconds """
+    to_ns = _TO_NS_BY_TYPE.get(type(time))
+    if to_ns is not None:
+        return to_ns(time)
+    if hasattr(time, 'to_nsec'):
+        return time.to_nsec()
+    return _float_to_ns(time)
+
+
+# bagmanager._jit compiles its helpers on import, so it's imported on the first query by _get_jit()
+_jit = None
+
+
+def _get_jit():
+    """ Return the bagmanager._jit module, importing it on the first call """
+    global _jit
+    if _jit is None:
+        _jit = importlib.import_module('bagmanager._jit')
+    return _jit
+
+
+# below this size a plain binary search on the sorted array is faster than the Eytzinger layout
+EYTZINGER_MIN_SIZE = 4096
+
+
+def _get_eytzinger_layout(sorted_ns: np.ndarray) -> Optional[tuple]:
+    """
+    Return the Eytzinger (BFS) layout of sorted_ns as a tuple (eytzinger_ns, eytzinger_idx) for cache friendly
+    searches on large arrays, or None if sorted_ns is too small for it to pay off.
+    """
+    if len(sorted_ns) < EYTZINGER_MIN_SIZE:
+        return None
+    eytzinger_ns = np.empty(len(sorted_ns) + 1, dtype=np.int64)
+    eytzinger_idx = np.empty(len(sorted_ns) + 1, dtype=np.int64)
+    _get_jit().build_eytzinger(sorted_ns, eytzinger_ns, eytzinger_idx)
+    return eytzinger_ns, eytzinger_idx
+
+
+def _closest_idx(sorted_ns: np.ndarray, eytzinger_layout: Optional[tuple], target_ns: int) -> int:
+    """ Return the index of the first value in sorted_ns closest to target_ns, using its Eytzinger layout if any """
+    if eytzinger_layout is None:
+        return _get_jit().closest_idx(sorted_ns, target_ns)
+    return _get_jit().eytzinger_closest_idx(sorted_ns, *eytzinger_layout, target_ns)
+
+
 class BagManager:
     def __init__(self, bag_file: PathLike):
         self.bag = rosbag.Bag(bag_file)
-        self.bag_info = self._get_bag_info(bag_file)
+        self._types_and_topics_info = self.bag.get_type_and_topic_info()
+        self.bag_info = self._get_bag_info()
+        self._topics_entries = self._get_topics_entries()
         self._topics_info_cache = {}
+        self._topics_rosbag_ns = None
 
-    @staticmethod
-    def _get_bag_info(bag_file: PathLike) -> Dict:
-        """ Return a dict with information about the given bag file"""
-        bag_file = str(bag_file)
-        bag_info = yaml.safe_load(subprocess.Popen(['rosbag', 'info', '--yaml', bag_file],
-                                                   stdout=subprocess.PIPE).communicate()[0])
+    def _get_bag_info(self) -> Dict:
+        """
+        Return a dict with the fields of `rosbag info --yaml` about the bag file, read from the already open bag index.
+        A bag without messages has start, end and duration of 0.
+        """
+        indexed = bool(self.bag._chunks or self.bag._connection_indexes)
+        if indexed:
+            start_time = self.bag.get_start_time()
+            end_time = self.bag.get_end_time()
+        else:
+            # get_start_time() and get_end_time() raise on a bag without messages
+            start_time = end_time = 0.0
+        types_and_topics = self._types_and_topics_info
+        topics = []
+        for topic, topic_tuple in sorted(types_and_topics.topics.items()):
+            topic_info = {'topic': topic, 'type': topic_tuple.msg_type, 'messages': topic_tuple.message_count,
+                          'frequency': topic_tuple.frequency}
+            if topic_tuple.connections > 1:
+                topic_info['connections'] = topic_tuple.connections
+            topics.append(topic_info)
+        types = [{'type': msg_type, 'md5': md5} for msg_type, md5 in sorted(types_and_topics.msg_types.items())]
+        compression_info = self.bag.get_compression_info()
+        bag_info = {'path': str(self.bag.filename),
+                    'version': float(f'{self.bag.version // 100}.{self.bag.version % 100}'),
+                    'duration': end_time - start_time, 'start': start_time, 'end': end_time, 'size': self.bag.size,
+                    'messages': sum(t['messages'] for t in topics), 'indexed': indexed,
+                    'compression': compression_info.compression, 'types': types, 'topics': topics}
+        if compression_info.compression != 'none':
+            bag_info['uncompressed'] = compression_info.uncompressed
+            bag_info['compressed'] = compression_info.compressed
         return bag_info
 
+    def _get_topics_entries(self) -> Dict:
+        """
+        Return a dict of topic -> list of the index entries of the topic messages sorted by rosbag time.
+        All the topics are bucketed in a single pass over the bag connections index.
+        """
+        topics_indexes = defaultdict(list)
+        for connection_id, connection in self.bag._connections.items():
+            topics_indexes[connection.topic].append(self.bag._connection_indexes.get(connection_id, []))
+        return {topic: list(indexes[0]) if len(indexes) == 1 else list(heapq.merge(*indexes, key=attrgetter('time')))
+                for topic, indexes in topics_indexes.items()}
+
+    def _get_topics_rosbag_ns(self) -> tuple:
+        """
+        Return a tuple (concat_ns, offsets, topics_ids) with the rosbag times of all the topics concatenated into a
+        single int64 ns array. The times of the topic with id i are concat_ns[offsets[i]:offsets[i + 1]],
+        and topics_ids is a dict of topic -> id.
+        It's built once on the first call.
+        """
+        if self._topics_rosbag_ns is None:
+            topics = list(self._topics_entries)
+            lengths = [len(self._topics_entries[topic]) for topic in topics]
+            concat_ns = np.fromiter((entry.time.to_nsec() for topic in topics for entry in self._topics_entries[topic]),
+                                    dtype=np.int64, count=sum(lengths))
+            offsets = np.zeros(len(topics) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths)
+            topics_ids = {topic: i for i, topic in enumerate(topics)}
+            self._topics_rosbag_ns = concat_ns, offsets, topics_ids
+        return self._topics_rosbag_ns
+
+    def _read_entry_message(self, entry, raw: bool = False) -> tuple:
+        """
+        Return the (topic, msg, t) of the message of the given index entry by seeking straight to its record.
+        2.0 bags address a message by its chunk position and offset in the chunk, 1.2 bags by its file offset.
+        """
+        if self.bag.version >= 200:
+            position = (entry.chunk_pos, entry.offset)
+        else:
+            position = entry.offset
+        return self.bag._read_message(position, raw=raw)
+
     def get_topic_info(self, topic: str, get_header_time: bool = False) -> Dict:
         """
         Return a dict with info about the given topic.
@@ -50,15 +176,42 @@ class BagManager:
         but returns also a list of the messages times from the messages headers.
         """
         def _cache_topic_info_without_msg_time_list_header():
-            topic_tuple = self.bag.get_type_and_topic_info().topics[topic]
-            connections = self.bag._get_connections([topic], connection_filter=None)
-            entry_gen = self.bag._get_entries(connections, start_time=None, end_time=None)
-            msg_time_list_rosbag = [entry.time for entry in entry_gen]
+            topic_tuple = self._types_and_topics_info.topics[topic]
+            msg_entry_list = self._topics_entries[topic]
+            msg_time_list_rosbag = [entry.time for entry in msg_entry_list]
+            # a view of the topic times in the concatenated array, so the times are held once for all the queries
+            concat_ns, offsets, topics_ids = self._get_topics_rosbag_ns()
+            topic_id = topics_ids[topic]
+            msg_time_list_rosbag_ns = concat_ns[offsets[topic_id]:offsets[topic_id + 1]]
             topic_info = {'topic': topic, 'message_count': topic_tuple.message_count,
                           'message_type': topic_tuple.msg_type, 'frequency': topic_tuple.frequency,
-                          'msg_time_list_header': None, 'msg_time_list_rosbag': msg_time_list_rosbag}
+                          'msg_time_list_header': None, 'msg_time_list_rosbag': msg_time_list_rosbag,
+                          'msg_time_list_rosbag_ns': msg_time_list_rosbag_ns, 'msg_entry_list': msg_entry_list,
+                          'msg_time_list_rosbag_eytzinger': None,
+                          'msg_time_list_header_ns': None,
+                          'msg_time_list_header_ns_sorted': None, 'msg_time_list_header_perm': None,
+                          'msg_time_list_header_eytzinger': None}
             return topic_info
 
+        def _read_msg_time_list_header_ns() -> Union[np.ndarray, BagManagerException]:
+            """
+            Return an array of the header stamps of the topic messages in nanoseconds,
+            or a BagManagerException if some msg doesn't have a header.
+            Only the serialized header is unpacked, the messages are not deserialized.
+            """
+            msg_time_list_header_ns = np.empty(len(topic_info['msg_entry_list']), dtype=np.int64)
+            # read the raw messages straight from the cached index entries so the bag index isn't walked again
+            # and the header times are aligned with msg_time_list_rosbag by construction
+            for i, entry in enumerate(topic_info['msg_entry_list']):
+                _, raw_msg, _ = self._read_entry_message(entry, raw=True)
+                data, pytype = raw_msg[1], raw_msg[-1]
+                if not pytype._has_header:
+                    return BagManagerException(f"Some msg doesn't have header timestamp ({pytype._type})")
+                # a serialized std_msgs/Header starts with: uint32 seq, uint32 stamp.secs, uint32 stamp.nsecs
+                secs, nsecs = struct.unpack_from('<4xII', data)
+                msg_time_list_header_ns[i] = secs * 1000000000 + nsecs
+            return msg_time_list_header_ns
+
         if topic in self._topics_info_cache:
             topic_info = self._topics_info_cache[topic]
         else:
@@ -67,10 +220,18 @@ class BagManager:
 
         if get_header_time:
             if topic_info['msg_time_list_header'] is None:
-                try:
-                    msg_time_list_header = [msg.header.stamp for _, msg, _ in self.bag.read_messages(topics=[topic])]
-                except AttributeError:
-                    msg_time_list_header = BagManagerException("Some msg doesn't have header timestamp")
+                msg_time_list_header_ns = _read_msg_time_list_header_ns()
+                if isinstance(msg_time_list_header_ns, BagManagerException):
+                    msg_time_list_header = msg_time_list_header_ns
+                else:
+                    msg_time_list_header = [rospy.Time(*divmod(int(t), 1000000000)) for t in msg_time_list_header_ns]
+                    # header times are not guaranteed to be monotonic, so sort them once and keep the permutation
+                    # to map the sorted index back to the bag order of msg_time_list_rosbag.
+                    # a stable sort keeps equal header times in bag order so the first of them is matched.
+                    perm = np.argsort(msg_time_list_header_ns, kind='stable')
+                    topic_info['msg_time_list_header_ns'] = msg_time_list_header_ns
+                    topic_info['msg_time_list_header_ns_sorted'] = msg_time_list_header_ns[perm]
+                    topic_info['msg_time_list_header_perm'] = perm
                 self._topics_info_cache[topic]['msg_time_list_header'] = msg_time_list_header
 
         return topic_info
@@ -78,35 +239,31 @@ class BagManager:
 
     def get_closest_message_by_header_time(self, topic: str, time_header: TimeLike) -> RosMessage:
         """ Returns a message from the given topic with header timestamp closest to time_header """
-        if not isinstance(time_header, rospy.Time) and not isinstance(time_header, genpy.Time):
-            time_header = rospy.Time(time_header)
         info = self.get_topic_info(topic=topic, get_header_time=True)
-        argmin = np.argmin([abs(t - time_header) for t in info['msg_time_list_header']])
-        matching_msg_time_rosbag = info['msg_time_list_rosbag'][argmin]
-        msg = [msg for _, msg, _ in self.bag.read_messages(topics=[topic],
-                                                           start_time=matching_msg_time_rosbag,
-                                                           end_time=matching_msg_time_rosbag)][0]
-        return msg
+        if isinstance(info['msg_time_list_header'], BagManagerException):
+            raise info['msg_time_list_header']
+        # the Eytzinger layout is built on the first closest query, so get_topic_info() doesn't compile _jit
+        if info['msg_time_list_header_eytzinger'] is None:
+            info['msg_time_list_header_eytzinger'] = _get_eytzinger_layout(info['msg_time_list_header_ns_sorted'])
+        idx = _closest_idx(info['msg_time_list_header_ns_sorted'], info['msg_time_list_header_eytzinger'],
+                           _to_ns(time_header))
+        return self.get_message_by_index(topic=topic, index=int(info['msg_time_list_header_perm'][idx]))
 
     def get_closest_message_by_rosbag_time(self, topic: str, time_rosbag: TimeLike) -> RosMessage:
         """ Returns a message from the given topic with rosbag timestamp closest to time_rosbag """
-        if not isinstance(time_rosbag, rospy.Time) and not isinstance(time_rosbag, genpy.Time):
-            time_rosbag = rospy.Time(time_rosbag)
         info = self.get_topic_info(topic=topic, get_header_time=False)
-        argmin = np.argmin([abs(t - time_rosbag) for t in info['msg_time_list_rosbag']])
-        matching_msg_time_rosbag = info['msg_time_list_rosbag'][argmin]
-        msg = [msg for _, msg, _ in self.bag.read_messages(topics=[topic],
-                                                           start_time=matching_msg_time_rosbag,
-                                                           end_time=matching_msg_time_rosbag)][0]
-        return msg
+        if info['msg_time_list_rosbag_eytzinger'] is None:
+            info['msg_time_list_rosbag_eytzinger'] = _get_eytzinger_layout(info['msg_time_list_rosbag_ns'])
+        idx = _closest_idx(info['msg_time_list_rosbag_ns'], info['msg_time_list_rosbag_eytzinger'],
+                           _to_ns(time_rosbag))
+        return self.get_message_by_index(topic=topic, index=idx)
 
     def get_message_by_index(self, topic: str, index: int) -> RosMessage:
         """ Returns a message from the given topic by the given index """
         info = self.get_topic_info(topic=topic, get_header_time=False)
-        msg_time_rosbag = info['msg_time_list_rosbag'][index]
-        msg = [msg for _, msg, _ in self.bag.read_messages(topics=[topic],
-                                                           start_time=msg_time_rosbag,
-                                                           end_time=msg_time_rosbag)][0]
+        entry = info['msg_entry_list'][index]
+        # seek straight to the message record of the index entry instead of running read_messages() on its time
+        _, msg, _ = self._read_entry_message(entry)
         return msg
 
     def get_message_count_in_interval(self, topics: Optional[Iterable[str]] = None,
@@ -127,18 +284,14 @@ class BagManager:
         if end_time_rosbag is None:
             end_time_rosbag = self.bag_info['end']
 
-        if not isinstance(start_time_rosbag, rospy.Time) and not isinstance(start_time_rosbag, genpy.Time):
-            start_time_rosbag = rospy.Time(start_time_rosbag)
-        if not isinstance(end_time_rosbag, rospy.Time) and not isinstance(end_time_rosbag, genpy.Time):
-            end_time_rosbag = rospy.Time(end_time_rosbag)
-
-        message_count = 0
-        for topic in topics:
-            msg_list = self.get_topic_info(topic=topic, get_header_time=False)['msg_time_list_rosbag']
-            number_of_msgs_in_interval = (np.searchsorted(msg_list, end_time_rosbag, side='right')
-                                          - np.searchsorted(msg_list, start_time_rosbag, side='left'))
-                                          
-            message_count += number_of_msgs_in_interval
+        start_ns = _to_ns(start_time_rosbag)
+        end_ns = _to_ns(end_time_rosbag)
+
+        # count in all the topics with a single compiled call over the concatenated rosbag times
+        concat_ns, offsets, topics_ids = self._get_topics_rosbag_ns()
+        ids = np.array([topics_ids[topic] for topic in topics], dtype=np.int64)
+        message_count = _get_jit().count_in_interval_segments(concat_ns, offsets[ids], offsets[ids + 1],
+                                                              start_ns, end_ns)
         return message_count
 
     def __repr__(self):
@@ -0,0 +1,122 @@
+"""
+Numba compiled helpers for the time searches of BagManager.
+All the times are int64 nanoseconds stored in contiguous sorted arrays.
+Every helper has an explicit signature so it's compiled when this module is imported, and cache=True keeps the
+compiled code on disk for the next sessions. BagManager imports this module lazily on the first query,
+so constructing a BagManager doesn't pay for it.
+"""
+import numpy as np
+from numba import njit
+
+
+@njit('i8(i8[::1], i8)', cache=True)
+def search_sorted_left(sorted_ns, target_ns):
+    """ Return the first index i such that sorted_ns[i] >= target_ns (same as np.searchsorted side='left') """
+    lo = 0
+    n = sorted_ns.shape[0]
+    while n > 0:
+        half = n >> 1
+        if sorted_ns[lo + half] < target_ns:
+            lo += half + 1
+            n -= half + 1
+        else:
+            n = half
+    return lo
+
+
+@njit('i8(i8[::1], i8)', cache=True)
+def search_sorted_right(sorted_ns, target_ns):
+    """ Return the first index i such that sorted_ns[i] > target_ns (same as np.searchsorted side='right') """
+    lo = 0
+    n = sorted_ns.shape[0]
+    while n > 0:
+        half = n >> 1
+        if sorted_ns[lo + half] <= target_ns:
+            lo += half + 1
+            n -= half + 1
+        else:
+            n = half
+    return lo
+
+
+@njit('i8(i8[::1], i8, i8)', cache=True)
+def count_in_interval(sorted_ns, start_ns, end_ns):
+    """ Return the number of values in the sorted array sorted_ns in the interval [start_ns, end_ns] """
+    return search_sorted_right(sorted_ns, end_ns) - search_sorted_left(sorted_ns, start_ns)
+
+
+@njit('i8(i8[::1], i8[::1], i8[::1], i8, i8)', cache=True)
+def count_in_interval_segments(concat_ns, segment_starts, segment_ends, start_ns, end_ns):
+    """
+    Return the number of values in the interval [start_ns, end_ns] summed over the segments of concat_ns.
+    Segment i is concat_ns[segment_starts[i]:segment_ends[i]] and must be sorted.
+    """
+    count = 0
+    for i in range(segment_starts.shape[0]):
+        count += count_in_interval(concat_ns[segment_starts[i]:segment_ends[i]], start_ns, end_ns)
+    return count
+
+
+@njit('i8(i8[::1], i8)', cache=True)
+def closest_idx(sorted_ns, target_ns):
+    """ Return the index of the first value in the sorted array sorted_ns closest to target_ns """
+    n = sorted_ns.shape[0]
+    if n == 0:
+        return 0
+    idx = search_sorted_left(sorted_ns, target_ns)
+    if idx == n or (idx > 0 and target_ns - sorted_ns[idx - 1] <= sorted_ns[idx] - target_ns):
+        idx = search_sorted_left(sorted_ns, sorted_ns[idx - 1])
+    return idx
+
+
+@njit('void(i8[::1], i8[::1], i8[::1])', cache=True)
+def build_eytzinger(sorted_ns, eytzinger_ns, eytzinger_idx):
+    """
+    Fill eytzinger_ns with the values of sorted_ns in Eytzinger (BFS) order and eytzinger_idx with their indexes
+    in sorted_ns. Both output arrays have len(sorted_ns) + 1 items, the tree is 1-based and item 0 is unused.
+    """
+    n = sorted_ns.shape[0]
+    stack = np.empty(64, dtype=np.int64)
+    top = 0
+    k = 1
+    i = 0
+    # in-order walk of the implicit tree, the i-th visited node gets the i-th smallest value
+    while top > 0 or k <= n:
+        while k <= n:
+            stack[top] = k
+            top += 1
+            k = 2 * k
+        top -= 1
+        k = stack[top]
+        eytzinger_ns[k] = sorted_ns[i]
+        eytzinger_idx[k] = i
+        i += 1
+        k = 2 * k + 1
+
+
+@njit('i8(i8[::1], i8[::1], i8)', cache=True)
+def eytzinger_search_left(eytzinger_ns, eytzinger_idx, target_ns):
+    """ Same as search_sorted_left but on the Eytzinger layout made by build_eytzinger """
+    n = eytzinger_ns.shape[0] - 1
+    k = 1
+    while k <= n:
+        k = 2 * k + (eytzinger_ns[k] < target_ns)
+    # the lower bound is the node where the search last went left: drop the trailing right turns and that left turn
+    while k & 1:
+        k >>= 1
+    k >>= 1
+    if k == 0:
+        return n
+    return eytzinger_idx[k]
+
+
+@njit('i8(i8[::1], i8[::1], i8[::1], i8)', cache=True)
+def eytzinger_closest_idx(sorted_ns, eytzinger_ns, eytzinger_idx, target_ns):
+    """ Same as closest_idx but the binary searches run on the Eytzinger layout of sorted_ns """
+    n = sorted_ns.shape[0]
+    if n == 0:
+        return 0
+    idx = eytzinger_search_left(eytzinger_ns, eytzinger_idx, target_ns)
+    if idx == n or (idx > 0 and target_ns - sorted_ns[idx - 1] <= sorted_ns[idx] - target_ns):
+        idx = eytzinger_search_left(eytzinger_ns, eytzinger_idx, sorted_ns[idx - 1])
+    return idx
@@ -25,7 +25,7 @@ setuptools.setup(
     python_requires='>=3.6',
     install_requires=[
         'numpy',
-        'pyyaml',
+        'numba',
         'pyrosenv',
         'pycrypto',
         'gnupg',
@@ -49,6 +49,42 @@ def bag_file():
     os.remove(bag_path)
 
 
+# header stamps (in seconds after UNORDERED_BASE_TIME) of the messages of unordered_bag_file, in bag order
+UNORDERED_HEADER_STAMPS = [5, 1, 9, 3, 7, 0, 8, 2, 6, 4]
+UNORDERED_BASE_TIME = 1000
+
+
+@pytest.fixture(scope='module')
+def unordered_bag_file():
+    bag_path = Path(tempfile.NamedTemporaryFile(suffix='.bag', delete=False).name)
+    with rosbag.Bag(bag_path, 'w') as bag:
+        for i, stamp in enumerate(UNORDERED_HEADER_STAMPS):
+            header = Header(stamp=rospy.Time(UNORDERED_BASE_TIME + stamp), frame_id='unordered_frame')
+            msg = create_cloud_xyz32(header, np.zeros((1, 3)))
+            bag.write('unordered_topic', msg, rospy.Time(UNORDERED_BASE_TIME + 20) + rospy.Duration(0.5 * i))
+
+    yield bag_path
+    os.remove(bag_path)
+
+
+LARGE_TOPIC_MESSAGE_COUNT = 4500
+
+
+@pytest.fixture(scope='module')
+def large_bag_file():
+    random_state = np.random.RandomState(1)
+    bag_path = Path(tempfile.NamedTemporaryFile(suffix='.bag', delete=False).name)
+    with rosbag.Bag(bag_path, 'w') as bag:
+        for i in range(LARGE_TOPIC_MESSAGE_COUNT):
+            t = rospy.Time(1000) + rospy.Duration(0.01 * i)
+            # the header stamps lag the rosbag times by up to 5 messages so they aren't in bag order
+            header = Header(stamp=t - rospy.Duration(random_state.uniform(0, 0.05)), frame_id='large_frame')
+            bag.write('large_topic', create_cloud_xyz32(header, np.zeros((1, 3))), t)
+
+    yield bag_path
+    os.remove(bag_path)
+
+
 def test_ctor(bag_file):
     from bagmanager import BagManager
     bag_manager = BagManager(bag_file=bag_file)
@@ -56,6 +92,28 @@ def test_ctor(bag_file):
     assert bool(bag_manager._topics_info_cache) == False
 
 
+def test_bag_info(bag_file):
+    from bagmanager import BagManager
+    bag_manager = BagManager(bag_file=bag_file)
+    bag_info = bag_manager.bag_info
+    assert bag_info['path'] == str(bag_file)
+    assert bag_info['version'] == 2.0
+    assert bag_info['indexed'] == True
+    assert bag_info['compression'] == 'none'
+    assert bag_info['size'] == os.path.getsize(bag_file)
+    assert bag_info['messages'] == 19
+    assert bag_info['duration'] == pytest.approx(bag_info['end'] - bag_info['start'], abs=1e-6)
+    with rosbag.Bag(bag_file) as bag:
+        msg_times = [t.to_sec() for _, _, t in bag.read_messages()]
+    assert bag_info['start'] == pytest.approx(min(msg_times), abs=1e-6)
+    assert bag_info['end'] == pytest.approx(max(msg_times), abs=1e-6)
+    assert [t['type'] for t in bag_info['types']] == ['sensor_msgs/PointCloud2']
+    assert [(t['topic'], t['type'], t['messages']) for t in bag_info['topics']] == \
+           [('fix_end_time', 'sensor_msgs/PointCloud2', 1), ('fix_start_time', 'sensor_msgs/PointCloud2', 1),
+            ('topic_1', 'sensor_msgs/PointCloud2', 10), ('topic_2', 'sensor_msgs/PointCloud2', 7)]
+    assert all('connections' not in t for t in bag_info['topics'])
+
+
 def test_topic_info_cache(bag_file):
     from bagmanager import BagManager
     bag_manager = BagManager(bag_file=bag_file)
@@ -70,6 +128,12 @@ def test_topic_info_cache(bag_file):
     assert 'topic_1' in bag_manager._topics_info_cache
     assert bag_manager._topics_info_cache['topic_1']['msg_time_list_header'] is not None
     assert 'topic_2' not in bag_manager._topics_info_cache
+    # the header times are parsed from the raw bytes, compare them with the fully deserialized messages
+    with rosbag.Bag(bag_file) as bag:
+        msg_stamps_ns = [msg.header.stamp.to_nsec() for _, msg, _ in bag.read_messages(topics=['topic_1'])]
+        msg_times_ns = [t.to_nsec() for _, _, t in bag.read_messages(topics=['topic_1'])]
+    assert topic_1_info_with_header_time['msg_time_list_header_ns'].tolist() == msg_stamps_ns
+    assert topic_1_info_with_header_time['msg_time_list_rosbag_ns'].tolist() == msg_times_ns
 
     topic_2_info_with_header_time = bag_manager.get_topic_info('topic_2', get_header_time=True)
     assert bool(bag_manager._topics_info_cache) == True
@@ -267,3 +331,122 @@ def test_get_message_count_all_topics_all_times(bag_file):
 
     message_count = bag_manager.get_message_count_in_interval(topics=['topic_1', 'topic_2'])
     assert message_count == 17
+
+
+def test_closest_idx():
+    from bagmanager._jit import closest_idx
+    sorted_ns = np.array([10, 20, 20, 30, 50], dtype=np.int64)
+    assert closest_idx(sorted_ns, 0) == 0
+    assert closest_idx(sorted_ns, 14) == 0
+    assert closest_idx(sorted_ns, 15) == 0  # on a tie the earlier message is returned
+    assert closest_idx(sorted_ns, 22) == 1  # the first of the equal times is returned
+    assert closest_idx(sorted_ns, 26) == 3
+    assert closest_idx(sorted_ns, 100) == 4
+
+
+def test_count_in_interval():
+    from bagmanager._jit import count_in_interval
+    sorted_ns = np.array([10, 20, 20, 30, 50], dtype=np.int64)
+    assert count_in_interval(sorted_ns, 0, 100) == 5
+    assert count_in_interval(sorted_ns, 20, 20) == 2
+    assert count_in_interval(sorted_ns, 21, 29) == 0
+    assert count_in_interval(sorted_ns, 10, 30) == 4
+    assert count_in_interval(sorted_ns, 51, 100) == 0
+
+
+def test_count_in_interval_segments():
+    from bagmanager._jit import count_in_interval_segments
+    concat_ns = np.array([10, 20, 30, 15, 25, 5, 50], dtype=np.int64)
+    segment_starts = np.array([0, 3, 5], dtype=np.int64)
+    segment_ends = np.array([3, 5, 7], dtype=np.int64)
+    assert count_in_interval_segments(concat_ns, segment_starts, segment_ends, 0, 100) == 7
+    assert count_in_interval_segments(concat_ns, segment_starts, segment_ends, 15, 25) == 3
+    assert count_in_interval_segments(concat_ns, segment_starts[1:], segment_ends[1:], 15, 25) == 2
+    assert count_in_interval_segments(concat_ns, segment_starts[:0], segment_ends[:0], 0, 100) == 0
+
+
+def test_eytzinger_closest_idx():
+    from bagmanager._jit import build_eytzinger, closest_idx, eytzinger_closest_idx
+    sorted_ns = np.sort(np.random.RandomState(0).randint(0, 1000, 5000)).astype(np.int64)
+    eytzinger_ns = np.empty(len(sorted_ns) + 1, dtype=np.int64)
+    eytzinger_idx = np.empty(len(sorted_ns) + 1, dtype=np.int64)
+    build_eytzinger(sorted_ns, eytzinger_ns, eytzinger_idx)
+    for target_ns in range(-10, 1010):
+        assert eytzinger_closest_idx(sorted_ns, eytzinger_ns, eytzinger_idx, target_ns) == \
+               closest_idx(sorted_ns, target_ns)
+
+
+def test_ctor_empty_bag():
+    from bagmanager import BagManager
+    bag_path = Path(tempfile.NamedTemporaryFile(suffix='.bag', delete=False).name)
+    try:
+        with rosbag.Bag(bag_path, 'w'):
+            pass
+        bag_manager = BagManager(bag_file=bag_path)
+        assert bag_manager.bag_info['messages'] == 0
+        assert bag_manager.bag_info['duration'] == 0
+        assert bag_manager.bag_info['indexed'] == False
+        assert bag_manager.bag_info['topics'] == []
+        assert bag_manager.get_message_count_in_interval() == 0
+        repr(bag_manager)
+    finally:
+        os.remove(bag_path)
+
+
+def test_get_closest_message_by_header_time_unordered(unordered_bag_file):
+    from bagmanager import BagManager
+    bag_manager = BagManager(bag_file=unordered_bag_file)
+    base_time = rospy.Time(UNORDERED_BASE_TIME)
+    topic_info = bag_manager.get_topic_info('unordered_topic', get_header_time=True)
+    assert topic_info['msg_time_list_header'] == [base_time + rospy.Duration(t) for t in UNORDERED_HEADER_STAMPS]
+
+    for stamp in UNORDERED_HEADER_STAMPS:
+        for offset in (-0.2, 0, 0.2):
+            time_header = base_time + rospy.Duration(stamp + offset)
+            msg = bag_manager.get_closest_message_by_header_time(topic='unordered_topic', time_header=time_header)
+            assert msg.header.stamp == base_time + rospy.Duration(stamp)
+
+    msg = bag_manager.get_closest_message_by_header_time(topic='unordered_topic',
+                                                         time_header=base_time - rospy.Duration(5))
+    assert msg.header.stamp == base_time + rospy.Duration(min(UNORDERED_HEADER_STAMPS))
+    msg = bag_manager.get_closest_message_by_header_time(topic='unordered_topic',
+                                                         time_header=base_time + rospy.Duration(50))
+    assert msg.header.stamp == base_time + rospy.Duration(max(UNORDERED_HEADER_STAMPS))
+
+
+def test_get_closest_message_eytzinger_layout(large_bag_file, monkeypatch):
+    import bagmanager
+    from bagmanager import BagManager
+    assert LARGE_TOPIC_MESSAGE_COUNT >= bagmanager.EYTZINGER_MIN_SIZE
+    bag_manager = BagManager(bag_file=large_bag_file)
+    topic_info = bag_manager.get_topic_info('large_topic', get_header_time=True)
+    # the layouts are built on the first closest query
+    assert topic_info['msg_time_list_rosbag_eytzinger'] is None
+    assert topic_info['msg_time_list_header_eytzinger'] is None
+
+    monkeypatch.setattr(bagmanager, 'EYTZINGER_MIN_SIZE', LARGE_TOPIC_MESSAGE_COUNT + 1)
+    sorted_bag_manager = BagManager(bag_file=large_bag_file)
+    sorted_topic_info = sorted_bag_manager.get_topic_info('large_topic', get_header_time=True)
+
+    header_ns = topic_info['msg_time_list_header_ns']
+    rosbag_ns = topic_info['msg_time_list_rosbag_ns']
+    first_ns = min(header_ns.min(), rosbag_ns.min())
+    last_ns = max(header_ns.max(), rosbag_ns.max())
+    for target_ns in np.linspace(first_ns - 10 ** 9, last_ns + 10 ** 9, 300).astype(np.int64):
+        target = rospy.Time(nsecs=int(target_ns))
+
+        msg = bag_manager.get_closest_message_by_header_time(topic='large_topic', time_header=target)
+        sorted_msg = sorted_bag_manager.get_closest_message_by_header_time(topic='large_topic', time_header=target)
+        expected_idx = int(np.argmin(np.abs(header_ns - target_ns)))
+        assert msg.header.stamp == sorted_msg.header.stamp == topic_info['msg_time_list_header'][expected_idx]
+
+        msg = bag_manager.get_closest_message_by_rosbag_time(topic='large_topic', time_rosbag=target)
+        sorted_msg = sorted_bag_manager.get_closest_message_by_rosbag_time(topic='large_topic', time_rosbag=target)
+        expected_idx = int(np.argmin(np.abs(rosbag_ns - target_ns)))
+        expected_msg = bag_manager.get_message_by_index(topic='large_topic', index=expected_idx)
+        assert msg.header.stamp == sorted_msg.header.stamp == expected_msg.header.stamp
+
+    assert topic_info['msg_time_list_rosbag_eytzinger'] is not None
+    assert topic_info['msg_time_list_header_eytzinger'] is not None
+    assert sorted_topic_info['msg_time_list_rosbag_eytzinger'] is None
+    assert sorted_topic_info['msg_time_list_header_eytzinger'] is None